@@ -1,4 +1,6 @@
+import bisect
 import collections
+import itertools
 import pathlib 
 
 
@@ -20,14 +22,116 @@ def parse(lines, *, debug=False):
         print(f"Parsed ranges: {ranges}")
     return ranges
 
+def digit_length_segments(first: int, last: int):
+    for n_digits in range(len(str(first)), len(str(last)) + 1):
+        lowest = max(first, 10 ** (n_digits - 1))
+        highest = min(last, 10 ** n_digits - 1)
+        if lowest <= highest:
+            yield n_digits, lowest, highest
+
+def pattern_prefixes(lowest: int, highest: int, n_digits: int, pattern_length: int):
+    # An ID of n_digits digits made of a pattern of pattern_length digits is
+    # the pattern times the repunit-like multiplier 10...010...01
+    multiplier = (10 ** n_digits - 1) // (10 ** pattern_length - 1)
+    prefix_lowest = max(10 ** (pattern_length - 1), -(-lowest // multiplier))
+    prefix_highest = min(10 ** pattern_length - 1, highest // multiplier)
+    return multiplier, prefix_lowest, prefix_highest
+
+def repeated_pattern_ids(first: int, last: int):
+    for n_digits, lowest, highest in digit_length_segments(first, last):
+        # IDs with a pattern of length p also repeat every multiple of p
+        ids = set()
+        for pattern_length in range(1, n_digits // 2 + 1):
+            if n_digits % pattern_length:
+                continue
+            multiplier, prefix_lowest, prefix_highest = pattern_prefixes(
+                lowest, highest, n_digits, pattern_length
+            )
+            ids.update(prefix * multiplier for prefix in range(prefix_lowest, prefix_highest + 1))
+        yield from sorted(ids)
+
+def sum_of_repeats(lowest: int, highest: int, n_digits: int, pattern_length: int) -> int:
+    multiplier, prefix_lowest, prefix_highest = pattern_prefixes(
+        lowest, highest, n_digits, pattern_length
+    )
+    if prefix_lowest > prefix_highest:
+        return 0
+    n_prefixes = prefix_highest - prefix_lowest + 1
+    return multiplier * (prefix_lowest + prefix_highest) * n_prefixes // 2
+
+def mobius(n: int) -> int:
+    result = 1
+    factor = 2
+    while factor * factor <= n:
+        if n % factor == 0:
+            n //= factor
+            if n % factor == 0:
+                return 0
+            result = -result
+        factor += 1
+    return -result if n > 1 else result
+
+def sum_of_repeated_patterns(lowest: int, highest: int, n_digits: int) -> int:
+    # A number repeating patterns of lengths p and q also repeats one of
+    # length gcd(p, q), so Mobius inversion over the divisors of n_digits
+    # counts every ID once, however many pattern lengths it has
+    return -sum(
+        mobius(n_digits // pattern_length) * sum_of_repeats(lowest, highest, n_digits, pattern_length)
+        for pattern_length in range(1, n_digits)
+        if n_digits % pattern_length == 0
+    )
+
+class InvalidIdIndex:
+    def __init__(self, max_digits: int = 12):
+        self.max_digits = max_digits
+        # Part 1 IDs repeat their first half exactly twice
+        self.ids = [
+            prefix * (10 ** (n_digits // 2) + 1)
+            for n_digits in range(2, max_digits + 1, 2)
+            for prefix in range(10 ** (n_digits // 2 - 1), 10 ** (n_digits // 2))
+        ]
+        self.ids_2 = list(repeated_pattern_ids(1, 10 ** max_digits - 1))
+        self.prefix_sums = list(itertools.accumulate(self.ids, initial=0))
+        self.prefix_sums_2 = list(itertools.accumulate(self.ids_2, initial=0))
+    
+    def __repr__(self) -> str:
+        return f"InvalidIdIndex(max_digits={self.max_digits})"
+    
+    def sum_invalid_ids(self, first: int, last: int):
+        if len(str(last)) > self.max_digits:
+            raise ValueError(f"Range {first}-{last} exceeds {self!r}")
+        sums = list()
+        for ids, prefix_sums in ((self.ids, self.prefix_sums), (self.ids_2, self.prefix_sums_2)):
+            lo = bisect.bisect_left(ids, first)
+            hi = bisect.bisect_right(ids, last)
+            sums.append(prefix_sums[hi] - prefix_sums[lo])
+        return tuple(sums)
+    
+    def sum_invalid_ids_many(self, bounds):
+        return [self.sum_invalid_ids(first, last) for first, last in bounds]
+
 class Range:
     def __init__(self, begin: str, end: str):
         self.begin = begin
         self.end = end
-        self.ids = set(i for i in range(int(begin), int(end) + 1))
+        self.first = int(begin)
+        self.last = int(end)
     
     def __str__(self) -> str:
         return f"{self.begin}-{self.end}"
+    
+    def __len__(self) -> int:
+        return max(self.last - self.first + 1, 0)
+    
+    def __contains__(self, id: int) -> bool:
+        return self.first <= id <= self.last
+    
+    def __iter__(self):
+        return iter(self.ids)
+    
+    @property
+    def ids(self) -> range:
+        return range(self.first, self.last + 1)
 
     @classmethod
     def fromstring(cls, input_string: str):
@@ -99,7 +203,55 @@ class RangesList(RangesListLike):
                         print(f"Atomic range found: {range}")
                     self.atomic_ranges.append(range)
     
-    def run_analysis(self, *, debug=False):
+    def merged_bounds(self):
+        # Overlapping input ranges must not count their shared IDs twice
+        bounds = list()
+        for r in sorted(self, key=lambda r: r.first):
+            if bounds and r.first <= bounds[-1][1] + 1:
+                bounds[-1][1] = max(bounds[-1][1], r.last)
+            else:
+                bounds.append([r.first, r.last])
+        return bounds
+    
+    def sum_invalid_ids_arithmetic(self, *, debug=False):
+        self.sum_invalid_ids = 0
+        self.sum_invalid_ids_2 = 0
+        for first, last in self.merged_bounds():
+            for n_digits, lowest, highest in digit_length_segments(first, last):
+                if n_digits % 2 == 0:
+                    self.sum_invalid_ids += sum_of_repeats(lowest, highest, n_digits, n_digits // 2)
+                self.sum_invalid_ids_2 += sum_of_repeated_patterns(lowest, highest, n_digits)
+                if debug:
+                    print(
+                        f"Segment {lowest}-{highest}: running sums "
+                        f"{self.sum_invalid_ids} and {self.sum_invalid_ids_2}"
+                    )
+    
+    def sum_invalid_ids_indexed(self, index=None, *, debug=False):
+        bounds = self.merged_bounds()
+        if index is None:
+            index = InvalidIdIndex(max(len(str(last)) for first, last in bounds))
+        sums = index.sum_invalid_ids_many(bounds)
+        if debug:
+            for (first, last), (sum_1, sum_2) in zip(bounds, sums):
+                print(f"Range {first}-{last}: sums {sum_1} and {sum_2} from {index!r}")
+        self.sum_invalid_ids = sum(sum_1 for sum_1, sum_2 in sums)
+        self.sum_invalid_ids_2 = sum(sum_2 for sum_1, sum_2 in sums)
+    
+    def run_analysis(self, *, engine="arithmetic", index=None, debug=False):
+        match engine:
+            case "arithmetic":
+                self.sum_invalid_ids_arithmetic(debug=debug)
+            case "index":
+                self.sum_invalid_ids_indexed(index, debug=debug)
+            case "sets":
+                self.find_invalid_ids(debug=debug)
+                self.sum_invalid_ids = sum([int(id) for id in self.invalid_ids])
+                self.sum_invalid_ids_2 = sum([int(id) for id in self.invalid_ids_2])
+            case _:
+                raise ValueError(f"Unknown engine: {engine!r}")
+    
+    def find_invalid_ids(self, *, debug=False):
         self.find_atomic_ranges(debug=debug)
         if debug:
             print(f"Atomic ranges: {self.atomic_ranges}")
@@ -116,23 +268,16 @@ class RangesList(RangesListLike):
                     print(f"Found invalid ID: {invalid_id}")
                 self.invalid_ids.add(invalid_id)
         for r in self:
-            for id in r.ids:
-                len_id = len(str(id))
-                for l in range(1, 1 + len_id // 2):
-                    repeat = str(id)[0:l]
-                    n_repeats = len_id // l
-                    repeated_id = repeat * n_repeats
-                    if repeated_id == str(id):
-                        self.invalid_ids_2.add(repeated_id)
-                        if debug:
-                            print(f"Found invalid ID (2): {repeated_id}")
-                        break
+            for id in repeated_pattern_ids(r.first, r.last):
+                self.invalid_ids_2.add(str(id))
+                if debug:
+                    print(f"Found invalid ID (2): {id}")
     
     def get_answer1(self, *, debug=False):
-        return sum([int(id) for id in self.invalid_ids])
+        return self.sum_invalid_ids
 
     def get_answer2(self, *, debug=False):
-        return sum([int(id) for id in self.invalid_ids_2])
+        return self.sum_invalid_ids_2
     
     def get_answers(self, *, debug=False):
         answer1 = self.get_answer1(debug=debug)
@@ -149,6 +294,13 @@ def test():
     object = parse(lines, debug=True)
     object.run_analysis(debug=True)
     test1, test2 = object.get_answers(debug=True)
+    sets_object = parse(lines)
+    sets_object.run_analysis(engine="sets")
+    assert sets_object.get_answers() == (test1, test2)
+    index = InvalidIdIndex(max_digits=10)
+    index_object = parse(lines)
+    index_object.run_analysis(engine="index", index=index, debug=True)
+    assert index_object.get_answers() == (test1, test2)
     print(f"Test 1: {test1}\nTest 2: {test2}")
 
 if __name__ == "__main__":
@@ -1,5 +1,12 @@
 import functools
+import gc
 import pathlib 
+import weakref
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 DAY = 3
@@ -21,10 +28,103 @@ def read_file(day: int):
 def parse(lines, *, debug=False):
     return BatteryBankCollection([BatteryBank(line.strip()) for line in lines])
 
+# Maps the ASCII digits of a bank to battery values 0-9
+# Digits map to their values, every other byte to 255 so it fails validation
+DIGIT_TABLE = bytes(byte - 48 if 48 <= byte <= 57 else 255 for byte in range(256))
+
+def max_joltage(batteries, n_batteries):
+    # Monotonic stack: a battery is dropped as soon as a higher one
+    # follows it, as long as enough batteries remain to pick n_batteries
+    n_droppable = len(batteries) - n_batteries
+    stack = []
+    for battery in batteries:
+        while n_droppable > 0 and stack and stack[-1] < battery:
+            stack.pop()
+            n_droppable -= 1
+        stack.append(battery)
+    jolt = 0
+    for battery in stack[:n_batteries]:
+        jolt = 10 * jolt + battery
+    return jolt
+
+def stream_joltages(lines, *, n_batteries=12, sink=None, debug=False):
+    # Fold one bank at a time into running sums, so memory does not grow with the input
+    total_joltage = 0
+    total_overdrive_joltage = 0
+    for index, line in enumerate(lines):
+        if isinstance(line, str):
+            line = line.encode()
+        batteries = line.strip().translate(DIGIT_TABLE)
+        if not batteries:
+            continue
+        if max(batteries) > 9:
+            raise ValueError(f"Bank {index} may only contain the digits 0-9")
+        if len(batteries) < max(2, n_batteries):
+            raise ValueError(f"Cannot pick {n_batteries} batteries from bank {index} of {len(batteries)}")
+        joltage = max_joltage(batteries, 2)
+        overdrive_joltage = max_joltage(batteries, n_batteries)
+        if debug:
+            print(f"Bank {index}: joltage {joltage}, overdrive joltage {overdrive_joltage}")
+        if sink is not None:
+            sink(index, joltage, overdrive_joltage)
+        total_joltage += joltage
+        total_overdrive_joltage += overdrive_joltage
+    return total_joltage, total_overdrive_joltage
+
+def stream_file(day: int, *, n_batteries=12, sink=None, debug=False):
+    file = pathlib.Path("data") / f"{day:02}.txt"
+    with open(file, "rb") as handle:
+        return stream_joltages(handle, n_batteries=n_batteries, sink=sink, debug=debug)
+
+def parse_bytes(data, *, debug=False):
+    if np is None:
+        raise ImportError("The batch engine requires numpy to be installed")
+    # View equal-length lines as the rows of a matrix, newlines included
+    newline = b"\r\n" if b"\r\n" in data[:data.find(b"\n") + 1] else b"\n"
+    data = data.rstrip(b"\r\n")
+    if not data:
+        raise ValueError("No battery banks in input")
+    data += newline
+    stride = data.find(b"\n") + 1
+    width = stride - len(newline)
+    if len(data) % stride:
+        raise ValueError("Battery banks must all have the same length")
+    rows = np.frombuffer(data, dtype=np.uint8).reshape(-1, stride)
+    if not (rows[:, width:] == np.frombuffer(newline, dtype=np.uint8)).all():
+        raise ValueError("Battery banks must all have the same length")
+    # Bytes below "0" wrap around, so one comparison catches every non-digit
+    digits = rows[:, :width] - ord("0")
+    if (digits > 9).any():
+        raise ValueError("Battery banks may only contain the digits 0-9")
+    if debug:
+        print(f"Parsed {digits.shape[0]} banks of {digits.shape[1]} batteries")
+    return BatteryMatrix(digits)
+
+def batch_max_joltages(digits, n_batteries):
+    # Greedy pick for all banks at once: the next battery is the leftmost
+    # maximum between the previous pick and the last position that still
+    # leaves room for the remaining batteries
+    n_banks, n_columns = digits.shape
+    dtype = np.int64 if n_batteries <= 18 else object
+    jolts = np.zeros(n_banks, dtype=dtype)
+    banks = np.arange(n_banks)
+    columns = np.arange(n_columns)
+    start = np.zeros(n_banks, dtype=np.intp)
+    signed_digits = digits.astype(np.int8)
+    for pick in range(n_batteries):
+        stop = n_columns - n_batteries + pick
+        in_window = (columns >= start[:, None]) & (columns <= stop)
+        position = np.argmax(np.where(in_window, signed_digits, -1), axis=1)
+        jolts = 10 * jolts + digits[banks, position].astype(dtype)
+        start = position + 1
+    return jolts
+
 
 class BatteryBank:
     def __init__(self, input_string):
         self.batteries = [int(c) for c in input_string]
+        # Lives and dies with the bank, unlike a functools.cache on the method
+        self.overdrive_joltages = dict()
     
     def __str__(self):
         return "".join(str(b) for b in self.batteries)
@@ -34,39 +134,59 @@ class BatteryBank:
     
     @functools.cached_property
     def joltage(self):
-        jolt = 0
-        for i in range(len(self) - 1):
-            for j in range(i + 1, len(self)):
-                test_jolt = 10 * self.batteries[i] + self.batteries[j]
-                if test_jolt > jolt:
-                    jolt = test_jolt
-        return jolt
+        return self.max_joltage(2)
+    
+    def max_joltage(self, n_batteries):
+        return max_joltage(self.batteries, n_batteries)
+    
+    def sparse_table(self):
+        # sparse_table[level][i] is the leftmost highest position in [i, i + 2 ** level)
+        table = [list(range(len(self)))]
+        width = 1
+        while 2 * width <= len(self):
+            previous = table[-1]
+            table.append([
+                previous[i]
+                if self.batteries[previous[i]] >= self.batteries[previous[i + width]]
+                else previous[i + width]
+                for i in range(len(self) - 2 * width + 1)
+            ])
+            width *= 2
+        return table
+    
+    def highest_position(self, table, left, right):
+        # Leftmost highest battery between positions left and right inclusive
+        level = (right - left + 1).bit_length() - 1
+        row = table[level]
+        i, j = row[left], row[right - (1 << level) + 1]
+        return i if self.batteries[i] >= self.batteries[j] else j
+    
+    def joltage_profile(self, max_batteries, debug=False):
+        if max_batteries > len(self):
+            raise ValueError(f"Cannot pick {max_batteries} batteries from a bank of {len(self)}")
+        # The table is only kept for the duration of this call
+        table = self.sparse_table()
+        profile = []
+        for n_batteries in range(1, max_batteries + 1):
+            jolt = 0
+            left = 0
+            for pick in range(n_batteries):
+                position = self.highest_position(table, left, len(self) - n_batteries + pick)
+                jolt = 10 * jolt + self.batteries[position]
+                left = position + 1
+            profile.append(jolt)
+        if debug:
+            print(f"Joltage profile for {self}: {profile}")
+        return profile
     
-    @functools.cache
     def overdrive_joltage(self, n_batteries=12, debug=False):
-        battery_positions = list(range(len(self) - n_batteries, len(self)))
-        for battery_index in range(n_batteries):
-            test_position = battery_positions[battery_index]
-            battery_position = battery_positions[battery_index]
-            leftmost_position = battery_positions[battery_index - 1] + 1 if battery_index > 0 else 0
-            if debug:
-                print(f"Choosing battery {battery_index} starting at position {battery_position}")
-                print(f"  Testing positions from {test_position} down to {leftmost_position}")
-            while test_position >= leftmost_position:
-                test_jolt = self.batteries[test_position]
-                battery_jolt = self.batteries[battery_position]
-                if debug:
-                    print(f"  Testing position {test_position} with jolt {test_jolt} against current battery position {battery_position} with jolt {battery_jolt}")
-                if test_jolt >= battery_jolt:
-                    if debug:
-                        print(f"    Found better battery at position {test_position} with jolt {test_jolt}")
-                    battery_position = test_position
-                test_position -= 1
-            battery_positions[battery_index] = battery_position
-        str_jolt = "".join(str(self.batteries[pos]) for pos in battery_positions)
+        if n_batteries in self.overdrive_joltages:
+            return self.overdrive_joltages[n_batteries]
+        jolt = self.max_joltage(n_batteries)
         if debug:
-            print(f"Overdrive joltage for {self} with {n_batteries} batteries: {str_jolt}")
-        return int(str_jolt)
+            print(f"Overdrive joltage for {self} with {n_batteries} batteries: {jolt}")
+        self.overdrive_joltages[n_batteries] = jolt
+        return jolt
             
 
 class BatteryBankCollection(list):
@@ -88,6 +208,10 @@ class BatteryBankCollection(list):
         for bank in self:
             self.overdrive_joltages.append(bank.overdrive_joltage(n_batteries, debug=debug))
     
+    def joltage_profile(self, max_batteries, debug=False):
+        profiles = [bank.joltage_profile(max_batteries, debug=debug) for bank in self]
+        return [sum(jolts) for jolts in zip(*profiles)]
+    
     def run_analysis(self, *, debug=False):
         self.calculate_joltages(debug=debug)
         self.calculate_overdrive_joltages(debug=debug)
@@ -104,11 +228,74 @@ class BatteryBankCollection(list):
         return answer1, answer2
 
 
+class BatteryMatrix:
+    def __init__(self, digits):
+        self.digits = digits
+    
+    def __str__(self):
+        return "\n".join("".join(str(d) for d in row) for row in self.digits)
+    
+    def __len__(self):
+        return len(self.digits)
+    
+    def run_analysis(self, *, debug=False):
+        self.joltages = batch_max_joltages(self.digits, 2)
+        self.overdrive_joltages = batch_max_joltages(self.digits, 12)
+        if debug:
+            print(f"Joltages: {self.joltages}")
+            print(f"Overdrive joltages: {self.overdrive_joltages}")
+    
+    def get_answer1(self, *, debug=False):
+        return sum(self.joltages.tolist())
+
+    def get_answer2(self, *, debug=False):
+        # Sum as Python ints, the total over all banks can overflow int64
+        return sum(self.overdrive_joltages.tolist())
+    
+    def get_answers(self, *, debug=False):
+        answer1 = self.get_answer1(debug=debug)
+        answer2 = self.get_answer2(debug=debug)
+        return answer1, answer2
+
+
 def test():
     lines = test_input.splitlines()
     object = parse(lines, debug=True)
     object.run_analysis(debug=True)
     test1, test2 = object.get_answers(debug=True)
+    assert stream_joltages(iter(lines), sink=print, debug=True) == (test1, test2)
+    for invalid_lines in ([b"12a4\n"], [b"12\x054\n"], ["12345"]):
+        try:
+            stream_joltages(invalid_lines)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"Accepted invalid banks {invalid_lines!r}")
+    profile = object.joltage_profile(12, debug=True)
+    assert (profile[1], profile[11]) == (test1, test2)
+    bank = weakref.ref(object[0])
+    assert object[0].overdrive_joltage(12) == object.overdrive_joltages[0]
+    del object
+    gc.collect()
+    assert bank() is None
+    if np is not None:
+        matrix = parse_bytes(test_input.encode(), debug=True)
+        matrix.run_analysis(debug=True)
+        assert matrix.get_answers() == (test1, test2)
+        for invalid_data in (b"123\n45\n6789\n", b"12a\n456\n", b""):
+            try:
+                parse_bytes(invalid_data)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError(f"Accepted invalid input {invalid_data!r}")
+        trailing_blank = parse_bytes(b"98765432101234\n98765432101234\n\n")
+        trailing_blank.run_analysis()
+        assert trailing_blank.get_answer1() == 196
+        long_banks = parse_bytes(b"9" * 18 + b"\n" + b"9" * 18 + b"\n")
+        long_banks.digits = np.repeat(long_banks.digits, 5, axis=0)
+        long_banks.overdrive_joltages = batch_max_joltages(long_banks.digits, 18)
+        assert long_banks.get_answer2() == 10 * (10 ** 18 - 1)
     print(f"Test 1: {test1}\nTest 2: {test2}")
 
 if __name__ == "__main__":
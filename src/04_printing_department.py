@@ -1,4 +1,7 @@
+import mmap
 import pathlib 
+import shutil
+import tempfile
 
 
 DAY = 4
@@ -17,97 +20,334 @@ test_input = """
 """.strip()
 
 
+NEIGHBOUR_DELTAS = [(-1, -1), (-1, 0), (-1, 1),
+                    ( 0, -1),          ( 0, 1),
+                    ( 1, -1),  (1, 0), ( 1, 1)]
+
+# Translation tables between the text plan and one byte per cell
+ROLL_TABLE = bytes(1 if c == ord("@") else 0 for c in range(256))
+ACCESSIBLE_TABLE = bytes(1 if count < 4 else 0 for count in range(256))
+RENDER_TABLE = bytes.maketrans(b"\x00\x01\x02", b".@x")
+BIT_TABLE = str.maketrans("@.", "10")
+RENDER_BIT_TABLE = str.maketrans("10", "@.")
+
+
 def read_file(day: int):
     file = pathlib.Path("data") / f"{day:02}.txt"
     with open(file, "r") as handle:
         lines = handle.readlines()
     return(lines)
 
-def parse(lines, *, debug=False):
-    fp = FloorPlan(lines)
+def parse(lines, *, bitmask=False, debug=False):
+    fp = BitmaskFloorPlan(lines) if bitmask else FloorPlan(lines)
     if debug:
         print("Parsed Floor Plan:")
         print(fp)
     return fp
 
+def count_neighbours(cells, width):
+    # Sum the eight shifted copies of the grid as one big integer per copy.
+    # Every count fits in its own byte, so no carry crosses into a neighbour.
+    size = len(cells)
+    value = int.from_bytes(cells, "little")
+    total = 0
+    for di, dj in NEIGHBOUR_DELTAS:
+        offset = di * width + dj
+        if offset > 0:
+            total += value >> (8 * offset)
+        else:
+            total += value << (-8 * offset)
+    total &= (1 << (8 * size)) - 1
+    return bytearray(total.to_bytes(size, "little"))
+
+def flagged_cells(flags):
+    k = flags.find(1)
+    while k != -1:
+        yield k
+        k = flags.find(1, k + 1)
+
+def accessible_row_mask(above, row, below):
+    # Bit-sliced adder: planes[k] holds bit k of every cell's neighbour count
+    planes = [0, 0, 0, 0]
+    for neighbours in (above << 1, above, above >> 1,
+                       row << 1,          row >> 1,
+                       below << 1, below, below >> 1):
+        carry = neighbours
+        for k in range(4):
+            planes[k], carry = planes[k] ^ carry, planes[k] & carry
+    # Rolls with fewer than four neighbours have neither bit 2 nor bit 3 set
+    return row & ~(planes[2] | planes[3])
+
+def remove_accessible_band(rows):
+    # The first and last rows are a halo: they give the neighbour counts at
+    # the band edges, but their own rolls belong to the adjacent bands
+    width = len(rows[0]) + 2
+    cells = bytearray(len(rows) * width)
+    for r, row in enumerate(rows):
+        cells[r * width + 1:(r + 1) * width - 1] = row.translate(ROLL_TABLE)
+    adjacent_rolls = count_neighbours(cells, width)
+    rolls = int.from_bytes(cells, "little")
+    accessible = int.from_bytes(adjacent_rolls.translate(ACCESSIBLE_TABLE), "little") & rolls
+    accessible &= ((1 << (8 * width * (len(rows) - 2))) - 1) << (8 * width)
+    remaining = (rolls ^ accessible).to_bytes(len(cells), "little")
+    new_rows = [
+        remaining[r * width + 1:(r + 1) * width - 1].translate(RENDER_TABLE)
+        for r in range(1, len(rows) - 1)
+    ]
+    return new_rows, accessible.bit_count()
+
 class FloorPlan:
     def __init__(self, lines):
         self.m = len(lines) + 2
         self.n = len(lines[0].strip()) + 2
-        empty_row = ["." ] * self.n
-        self.grid = list([empty_row])
-        for line in lines:
-            row = ["."] + [c for c in line.strip()] + ["."]
-            assert(len(row) == self.n)
-            self.grid.append(row)
-        self.grid.append(empty_row)
+        # One byte per cell, row after row, with a border of empty cells
+        self.rolls = bytearray(self.m * self.n)
+        for i, line in enumerate(lines, start=1):
+            row = line.strip().encode()
+            assert(len(row) == self.n - 2)
+            self.rolls[i * self.n + 1:(i + 1) * self.n - 1] = row.translate(ROLL_TABLE)
+        self.neighbour_offsets = [di * self.n + dj for di, dj in NEIGHBOUR_DELTAS]
         self.rolls_removed = list()
+        self.create_accessibility_plan()
     
-    def __str__(self):
+    def render(self, cells):
         s = ""
-        for row in self.grid:
-            s += "".join(row) + "\n"
+        for i in range(self.m):
+            s += cells[i * self.n:(i + 1) * self.n].translate(RENDER_TABLE).decode() + "\n"
         return s
     
+    def __str__(self):
+        return self.render(self.rolls)
+    
     def count_adjacent_rolls(self, i, j):
-        deltas = [(-1, -1), (-1, 0), (-1, 1),
-                  ( 0, -1),          ( 0, 1),
-                  ( 1, -1),  (1, 0), ( 1, 1)]
-        count = 0
-        for di, dj in deltas:
-            neighbour_i, neighbour_j = i + di, j + dj
-            if self.grid[neighbour_i][neighbour_j] == "@":
-                count += 1
-        return count
+        k = i * self.n + j
+        return sum(self.rolls[k + offset] for offset in self.neighbour_offsets)
 
     def create_accessibility_plan(self, debug=False):
-        self.accessibility_grid = [
-            ["." for _ in range(self.n)]
-            for _ in range(self.m)
-        ]
-        for i in range(1, self.m - 1):
-            for j in range(1, self.n - 1):
-                c = self.grid[i][j]
-                if c == ".":
-                    continue
-                adjacent_rolls = self.count_adjacent_rolls(i, j)
-                if adjacent_rolls < 4:
-                    self.accessibility_grid[i][j] = "x"
-                else:
-                    self.accessibility_grid[i][j] = "@"
-
-        self.accessibility_plan = ""
-        for row in self.accessibility_grid:
-            self.accessibility_plan += "".join(row) + "\n"
+        self.adjacent_rolls = count_neighbours(self.rolls, self.n)
+        rolls = int.from_bytes(self.rolls, "little")
+        accessible = int.from_bytes(self.adjacent_rolls.translate(ACCESSIBLE_TABLE), "little")
+        accessible &= rolls
+        # Every cell holds 0 or 1, so the set bits count the accessible rolls
+        self.n_accessible = accessible.bit_count()
+        self.accessible = bytearray(accessible.to_bytes(len(self.rolls), "little"))
         if debug:
             print("Accessibility Plan:")
-            print(self.accessibility_plan)
-        return self.accessibility_plan
+            print(self.render_accessibility_plan())
+        return self.accessible
+    
+    def render_accessibility_plan(self):
+        # Rolls render as "@", accessible rolls as "x"
+        total = int.from_bytes(self.rolls, "little") + int.from_bytes(self.accessible, "little")
+        return self.render(total.to_bytes(len(self.rolls), "little"))
     
     def remove_accessible_rolls(self, *, debug=False):
-        for i, row in enumerate(self.accessibility_plan.splitlines()):
-            for j, c in enumerate(row.strip()):
-                if c == "x":
-                    self.grid[i][j] = "."
+        rolls = int.from_bytes(self.rolls, "little") ^ int.from_bytes(self.accessible, "little")
+        self.rolls = bytearray(rolls.to_bytes(len(self.rolls), "little"))
         if debug:
             print("Updated Floor Plan after removing accessible rolls:")
             print(self)
     
-    def run_analysis(self, *, debug=False):
-        self.first_plan = self.create_accessibility_plan(debug=debug)
-        self.rolls_removed.append(self.n_accessible_rolls(debug=debug))
-        while self.n_accessible_rolls(debug=debug):
-            self.remove_accessible_rolls(debug=debug)
-            self.create_accessibility_plan(debug=debug)
-            self.rolls_removed.append(self.n_accessible_rolls(debug=debug))
+    def peel_rolls(self, *, debug=False):
+        # Like a k-core decomposition: only rolls next to a removed roll can
+        # become accessible, so each round only looks at those neighbours
+        frontier = list(flagged_cells(self.accessible))
+        rolls = self.rolls
+        adjacent_rolls = self.adjacent_rolls
+        while True:
+            self.rolls_removed.append(len(frontier))
+            if not frontier:
+                break
+            for k in frontier:
+                rolls[k] = 0
+            next_frontier = list()
+            for k in frontier:
+                for offset in self.neighbour_offsets:
+                    adjacent_rolls[k + offset] -= 1
+                    if rolls[k + offset] and adjacent_rolls[k + offset] == 3:
+                        next_frontier.append(k + offset)
+            if debug:
+                print(f"Removed {len(frontier)} accessible rolls:")
+                print(self)
+            frontier = next_frontier
+        # Peeling stops once no roll is accessible any more
+        self.accessible = bytearray(len(self.rolls))
+        self.n_accessible = 0
+    
+    def update_accessibility(self, k):
+        accessible = 1 if self.rolls[k] and self.adjacent_rolls[k] < 4 else 0
+        self.n_accessible += accessible - self.accessible[k]
+        self.accessible[k] = accessible
+    
+    def set_roll(self, i, j, roll):
+        # (i, j) index the padded grid, like count_adjacent_rolls
+        assert(1 <= i < self.m - 1 and 1 <= j < self.n - 1)
+        k = i * self.n + j
+        if self.rolls[k] == roll:
+            return False
+        self.rolls[k] = roll
+        delta = 1 if roll else -1
+        for offset in self.neighbour_offsets:
+            self.adjacent_rolls[k + offset] += delta
+            self.update_accessibility(k + offset)
+        self.update_accessibility(k)
+        return True
+    
+    def add_roll(self, i, j):
+        return self.set_roll(i, j, 1)
+    
+    def remove_roll(self, i, j):
+        return self.set_roll(i, j, 0)
+    
+    def run_analysis(self, *, engine="worklist", debug=False):
+        match engine:
+            case "worklist":
+                self.peel_rolls(debug=debug)
+            case "rounds":
+                self.first_plan = self.create_accessibility_plan(debug=debug)
+                self.rolls_removed.append(self.n_accessible_rolls(debug=debug))
+                while self.n_accessible_rolls(debug=debug):
+                    self.remove_accessible_rolls(debug=debug)
+                    self.create_accessibility_plan(debug=debug)
+                    self.rolls_removed.append(self.n_accessible_rolls(debug=debug))
+            case _:
+                raise ValueError(f"Unknown engine: {engine!r}")
     
     def n_accessible_rolls(self, *, debug=False):
-        n_accessible_rolls = 0
-        for row in self.accessibility_grid:
-            for c in row:
-                if c == "x":
-                    n_accessible_rolls += 1
-        return n_accessible_rolls
+        return self.n_accessible
+    
+    def get_answer1(self, *, debug=False):
+        return self.rolls_removed[0]
+
+    def get_answer2(self, *, debug=False):
+        return sum(self.rolls_removed)
+    
+    def get_answers(self, *, debug=False):
+        answer1 = self.get_answer1(debug=debug)
+        answer2 = self.get_answer2(debug=debug)
+        return answer1, answer2
+
+
+class BitmaskFloorPlan:
+    def __init__(self, lines):
+        self.m = len(lines) + 2
+        self.n = len(lines[0].strip()) + 2
+        # Bit j of a row is set when column j holds a roll, with a border of empty cells
+        self.rows = [0]
+        for line in lines:
+            row = line.strip()
+            assert(len(row) == self.n - 2)
+            self.rows.append(int(row[::-1].translate(BIT_TABLE), 2) << 1)
+        self.rows.append(0)
+        self.rolls_removed = list()
+    
+    def __str__(self):
+        s = ""
+        for row in self.rows:
+            s += f"{row:0{self.n}b}"[::-1].translate(RENDER_BIT_TABLE) + "\n"
+        return s
+    
+    def run_analysis(self, *, debug=False):
+        # Only rows next to a row that lost rolls can gain accessible rolls
+        dirty_rows = range(1, self.m - 1)
+        while True:
+            accessible = dict()
+            for i in sorted(dirty_rows):
+                mask = accessible_row_mask(self.rows[i - 1], self.rows[i], self.rows[i + 1])
+                if mask:
+                    accessible[i] = mask
+            self.rolls_removed.append(sum(mask.bit_count() for mask in accessible.values()))
+            if not accessible:
+                break
+            dirty_rows = set()
+            for i, mask in accessible.items():
+                self.rows[i] &= ~mask
+                dirty_rows.update((i - 1, i, i + 1))
+            dirty_rows -= {0, self.m - 1}
+            if debug:
+                print(f"Removed {self.rolls_removed[-1]} accessible rolls:")
+                print(self)
+    
+    def get_answer1(self, *, debug=False):
+        return self.rolls_removed[0]
+
+    def get_answer2(self, *, debug=False):
+        return sum(self.rolls_removed)
+    
+    def get_answers(self, *, debug=False):
+        answer1 = self.get_answer1(debug=debug)
+        answer2 = self.get_answer2(debug=debug)
+        return answer1, answer2
+
+
+class TiledFloorPlan:
+    def __init__(self, path, *, band_rows=1024):
+        self.path = pathlib.Path(path)
+        self.band_rows = band_rows
+        self.rolls_removed = list()
+    
+    def read_row(self, plan, i):
+        if i < 0 or i >= self.m:
+            return b"." * self.n
+        return plan[i * self.stride:i * self.stride + self.n]
+    
+    def write_row(self, plan, i, row):
+        plan[i * self.stride:i * self.stride + self.n] = row
+    
+    def remove_accessible_rolls(self, plan, dirty_bands, *, debug=False):
+        changed_bands = set()
+        n_removed = 0
+        above = None
+        for band in range(self.n_bands):
+            start = band * self.band_rows
+            stop = min(start + self.band_rows, self.m)
+            if band not in dirty_bands:
+                above = None
+                continue
+            # The previous band has already been updated in this round, so
+            # its last row comes from the copy taken before the update
+            if above is None:
+                above = self.read_row(plan, start - 1)
+            rows = [above] + [self.read_row(plan, i) for i in range(start, stop + 1)]
+            above = rows[-2]
+            new_rows, n_band_removed = remove_accessible_band(rows)
+            if n_band_removed:
+                for i, row in enumerate(new_rows, start=start):
+                    self.write_row(plan, i, row)
+                changed_bands.add(band)
+                n_removed += n_band_removed
+            if debug:
+                print(f"Band {band} (rows {start}-{stop - 1}): removed {n_band_removed} rolls")
+        return changed_bands, n_removed
+    
+    def run_analysis(self, *, debug=False):
+        # Work on a copy of the input on disk, so only one band is ever in memory
+        with open(self.path, "rb") as source, tempfile.TemporaryFile() as work:
+            shutil.copyfileobj(source, work)
+            work.flush()
+            with mmap.mmap(work.fileno(), 0) as plan:
+                end_of_line = plan.find(b"\n")
+                if end_of_line == -1:
+                    end_of_line = len(plan)
+                self.stride = end_of_line + 1
+                self.n = end_of_line
+                if end_of_line > 0 and plan[end_of_line - 1] == ord("\r"):
+                    self.n -= 1
+                # The last row may or may not end with a newline
+                self.m = (len(plan) + self.stride - self.n) // self.stride
+                self.n_bands = -(-self.m // self.band_rows)
+                dirty_bands = set(range(self.n_bands))
+                while True:
+                    changed_bands, n_removed = self.remove_accessible_rolls(plan, dirty_bands, debug=debug)
+                    self.rolls_removed.append(n_removed)
+                    if not n_removed:
+                        break
+                    dirty_bands = {
+                        band + delta
+                        for band in changed_bands
+                        for delta in (-1, 0, 1)
+                        if 0 <= band + delta < self.n_bands
+                    }
     
     def get_answer1(self, *, debug=False):
         return self.rolls_removed[0]
@@ -126,6 +366,26 @@ def test():
     object = parse(lines, debug=True)
     object.run_analysis(debug=True)
     test1, test2 = object.get_answers(debug=True)
+    rounds_object = parse(lines)
+    rounds_object.run_analysis(engine="rounds")
+    assert rounds_object.rolls_removed == object.rolls_removed
+    bitmask_object = parse(lines, bitmask=True, debug=True)
+    bitmask_object.run_analysis(debug=True)
+    assert bitmask_object.rolls_removed == object.rolls_removed
+    assert str(bitmask_object) == str(object)
+    edited_object = parse(lines)
+    for i, j in [(1, 1), (1, 3), (5, 5), (10, 10), (1, 3)]:
+        if not edited_object.add_roll(i, j):
+            edited_object.remove_roll(i, j)
+    n_accessible = edited_object.n_accessible_rolls()
+    edited_object.create_accessibility_plan()
+    assert edited_object.n_accessible_rolls() == n_accessible
+    with tempfile.TemporaryDirectory() as directory:
+        path = pathlib.Path(directory) / f"{DAY:02}.txt"
+        path.write_text(test_input + "\n")
+        tiled_object = TiledFloorPlan(path, band_rows=3)
+        tiled_object.run_analysis(debug=True)
+        assert tiled_object.rolls_removed == object.rolls_removed
     print(f"Test 1: {test1}\nTest 2: {test2}")
 
 if __name__ == "__main__":
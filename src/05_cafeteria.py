@@ -1,8 +1,15 @@
-import itertools
+import bisect
 import pathlib 
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 DAY = 5
+CHUNK_SIZE = 1 << 16
 
 test_input = """
 3-5
@@ -50,6 +57,64 @@ def parse(lines, *, debug=False):
         print("Parsed inventory:\n", inventory)
     return inventory
 
+def parse_stream(lines, *, debug=False):
+    # Read only the fresh ranges up front; the ingredients stay a lazy generator
+    lines = iter(lines)
+    fresh_ranges = list()
+    for line in lines:
+        line = line.strip()
+        if line == "":
+            break
+        start, stop = line.split("-")
+        if debug:
+            print(f"  Found fresh range: {start=} {stop=}")
+        fresh_ranges.append(range(int(start), int(stop) + 1))
+    inventory = Inventory(fresh_ranges, list())
+    inventory.condense_all_ranges(debug=debug)
+    inventory.freshness_index = FreshnessIndex(inventory.condensed_ranges)
+    ingredients = (int(line) for line in lines if line.strip())
+    return inventory, ingredients
+
+
+def parse_integers(data, begin=0, stop=None, *, chunk_size=CHUNK_SIZE):
+    # Split data[begin:stop] at whitespace and dashes in fixed-size chunks,
+    # so only one chunk is copied and only its tokens are alive
+    stop = len(data) if stop is None else stop
+    integers = array("q")
+    while begin < stop:
+        end = min(begin + chunk_size, stop)
+        while end < stop and data[end:end + 1] not in b" \t\r\n-":
+            end += 1
+        integers.extend(map(int, data[begin:end].replace(b"-", b" ").split()))
+        begin = end
+    return integers
+
+def find_blank_line(data):
+    # Position of the blank line between fresh ranges and ingredients
+    if data[:1] == b"\n" or data[:2] == b"\r\n":
+        return 0
+    positions = [data.find(b"\n\n"), data.find(b"\n\r\n")]
+    positions = [position for position in positions if position >= 0]
+    return min(positions, default=len(data))
+
+def parse_bytes(data, *, debug=False):
+    # Both halves are parsed in place, without rewriting the whole buffer
+    separator = find_blank_line(data)
+    bounds = parse_integers(data, 0, separator)
+    ingredients = parse_integers(data, separator)
+    if np is not None:
+        bounds = np.frombuffer(bounds, dtype=np.int64)
+        starts = bounds[0::2].copy()
+        stops = bounds[1::2] + 1
+        ingredients = np.frombuffer(ingredients, dtype=np.int64)
+    else:
+        starts = bounds[0::2]
+        stops = array("q", (stop + 1 for stop in bounds[1::2]))
+    inventory = CompactInventory(starts, stops, ingredients)
+    if debug:
+        print(f"Parsed {len(starts)} fresh ranges and {len(ingredients)} ingredients")
+    return inventory
+
 
 def condense_ranges(range1, range2):
     # Ensure range1 starts before range2
@@ -62,6 +127,54 @@ def condense_ranges(range1, range2):
     else:
         # Ranges are separate and range1 starts before range2
         return range1, range2
+
+class FreshnessIndex:
+    def __init__(self, condensed_ranges):
+        # Parallel arrays over sorted, non-overlapping ranges
+        self.starts = [r.start for r in condensed_ranges]
+        self.stops = [r.stop for r in condensed_ranges]
+    
+    @classmethod
+    def from_bounds(cls, starts, stops):
+        index = cls(list())
+        index.starts = starts
+        index.stops = stops
+        return index
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def insert(self, fresh_range):
+        # Merge with every range that overlaps or touches the new one
+        start, stop = fresh_range.start, fresh_range.stop
+        lo = bisect.bisect_left(self.stops, start)
+        hi = bisect.bisect_right(self.starts, stop)
+        if lo < hi:
+            start = min(start, self.starts[lo])
+            stop = max(stop, self.stops[hi - 1])
+        del self.starts[lo:hi]
+        del self.stops[lo:hi]
+        self.starts.insert(lo, start)
+        self.stops.insert(lo, stop)
+        return lo, hi, range(start, stop)
+    
+    def __contains__(self, ingredient):
+        k = bisect.bisect_right(self.starts, ingredient) - 1
+        return k >= 0 and ingredient < self.stops[k]
+    
+    def freshness(self, ingredients):
+        # Walk the sorted ingredients and the ranges side by side
+        fresh = [False] * len(ingredients)
+        k = 0
+        for position in sorted(range(len(ingredients)), key=ingredients.__getitem__):
+            ingredient = ingredients[position]
+            while k < len(self.stops) and self.stops[k] <= ingredient:
+                k += 1
+            if k == len(self.stops):
+                break
+            fresh[position] = self.starts[k] <= ingredient
+        return fresh
+
 class Inventory:
     def __init__(self, fresh_ranges, ingredients):
         self.fresh_ranges = fresh_ranges
@@ -76,10 +189,15 @@ class Inventory:
             s += f"{ingredient}\n"
         return s
 
-    def determine_freshness(self, *, debug=False):
+    def determine_freshness(self, *, batch=False, debug=False):
+        self.freshness_index = FreshnessIndex(self.condensed_ranges)
+        if batch:
+            freshness = self.freshness_index.freshness(self.ingredients)
+        else:
+            freshness = (ingredient in self.freshness_index for ingredient in self.ingredients)
         self.fresh_ingredients = list()
-        for ingredient in self.ingredients:
-            if any(ingredient in r for r in self.fresh_ranges):
+        for ingredient, fresh in zip(self.ingredients, freshness):
+            if fresh:
                 if debug:
                     print(f"Ingredient {ingredient} is fresh.")
                 self.fresh_ingredients.append(ingredient)
@@ -87,33 +205,44 @@ class Inventory:
                 if debug:
                     print(f"Ingredient {ingredient} is spoiled.")
     
+    def stream_freshness(self, ingredients, *, sink=None, debug=False):
+        n_fresh = 0
+        for ingredient in ingredients:
+            fresh = ingredient in self.freshness_index
+            if debug:
+                print(f"Ingredient {ingredient} is {'fresh' if fresh else 'spoiled'}.")
+            if sink is not None:
+                sink(ingredient, fresh)
+            n_fresh += fresh
+        return n_fresh
+    
+    def add_fresh_range(self, fresh_range):
+        # Keep the parsed and condensed ranges in step with the live index,
+        # so a later run_analysis and get_answer2 include the new range
+        lo, hi, condensed = self.freshness_index.insert(fresh_range)
+        self.condensed_ranges[lo:hi] = [condensed]
+        self.fresh_ranges.append(fresh_range)
+    
     def condense_all_ranges(self, *, debug=False):
-        condensed_ranges = self.fresh_ranges.copy()
-        run_loop = True
-        while run_loop:
-            # Only continue looping when at least one pair of ranges was condensed
-            run_loop = False
-            for range1, range2 in itertools.product(condensed_ranges, repeat=2):
-                if range1 is range2:
-                    if debug:
-                        print(f"Skip same range comparison {range1=}")
-                    continue
+        # Sweep the ranges by start, so each one can only merge with the last condensed range
+        self.condensed_ranges = list()
+        for fresh_range in sorted(self.fresh_ranges, key=lambda r: r.start):
+            if not self.condensed_ranges:
+                self.condensed_ranges.append(fresh_range)
+                continue
+            if debug:
+                print(f"Considering {self.condensed_ranges[-1]=}, {fresh_range=}")
+            condensed = condense_ranges(self.condensed_ranges[-1], fresh_range)
+            if isinstance(condensed, range):
                 if debug:
-                    print(f"Considering {range1=}, {range2=}")
-                condensed = condense_ranges(range1, range2)
-                if isinstance(condensed, range):
-                    if debug:
-                        print(f"    Condensing into {condensed=}")
-                    condensed_ranges.remove(range1)
-                    condensed_ranges.remove(range2)
-                    condensed_ranges.append(condensed)
-                    run_loop = True
-                    break
-        self.condensed_ranges = list(condensed_ranges)
+                    print(f"    Condensing into {condensed=}")
+                self.condensed_ranges[-1] = condensed
+            else:
+                self.condensed_ranges.append(fresh_range)
 
-    def run_analysis(self, *, debug=False):
-        self.determine_freshness(debug=debug)
+    def run_analysis(self, *, batch=False, debug=False):
         self.condense_all_ranges(debug=debug)
+        self.determine_freshness(batch=batch, debug=debug)
     
     def get_answer1(self, *, debug=False):
         return len(self.fresh_ingredients)
@@ -127,11 +256,113 @@ class Inventory:
         return answer1, answer2
 
 
+class CompactInventory:
+    def __init__(self, starts, stops, ingredients):
+        # Range starts, exclusive stops and ingredients in array("q") or
+        # numpy int64 buffers, without a Python object per entry
+        self.starts = starts
+        self.stops = stops
+        self.ingredients = ingredients
+    
+    def __str__(self):
+        s = ""
+        for start, stop in zip(self.starts, self.stops):
+            s += f"{start}-{stop - 1}\n"
+        s += "\n"
+        for ingredient in self.ingredients:
+            s += f"{ingredient}\n"
+        return s
+    
+    def condense_all_ranges(self, *, debug=False):
+        # With starts and stops sorted separately, the union has a gap before
+        # the i-th start exactly when it lies beyond the (i - 1)-th stop
+        if np is not None and isinstance(self.starts, np.ndarray):
+            starts = np.sort(self.starts)
+            stops = np.sort(self.stops)
+            new_group = np.flatnonzero(starts[1:] > stops[:-1]) + 1
+            if len(starts):
+                self.condensed_starts = starts[np.concatenate(([0], new_group))]
+                self.condensed_stops = stops[np.concatenate((new_group - 1, [len(stops) - 1]))]
+            else:
+                self.condensed_starts = starts
+                self.condensed_stops = stops
+        else:
+            starts = array("q", sorted(self.starts))
+            stops = array("q", sorted(self.stops))
+            self.condensed_starts = array("q")
+            self.condensed_stops = array("q")
+            for i in range(len(starts)):
+                if i == 0 or starts[i] > stops[i - 1]:
+                    if i > 0:
+                        self.condensed_stops.append(stops[i - 1])
+                    self.condensed_starts.append(starts[i])
+            if len(stops):
+                self.condensed_stops.append(stops[-1])
+        if debug:
+            print(f"Condensed {len(self.starts)} fresh ranges into {len(self.condensed_starts)}")
+    
+    def determine_freshness(self, *, debug=False):
+        if np is not None and isinstance(self.ingredients, np.ndarray):
+            k = np.searchsorted(self.condensed_starts, self.ingredients, side="right") - 1
+            if len(self.condensed_stops):
+                fresh = (k >= 0) & (self.ingredients < self.condensed_stops[np.maximum(k, 0)])
+                self.n_fresh = int(np.count_nonzero(fresh))
+            else:
+                self.n_fresh = 0
+        else:
+            index = FreshnessIndex.from_bounds(self.condensed_starts, self.condensed_stops)
+            self.n_fresh = sum(ingredient in index for ingredient in self.ingredients)
+        if debug:
+            print(f"{self.n_fresh} of {len(self.ingredients)} ingredients are fresh")
+    
+    def run_analysis(self, *, debug=False):
+        self.condense_all_ranges(debug=debug)
+        self.determine_freshness(debug=debug)
+    
+    def get_answer1(self, *, debug=False):
+        return self.n_fresh
+
+    def get_answer2(self, *, debug=False):
+        # Sum the range lengths, the separate totals of starts and stops can overflow int64
+        if np is not None and isinstance(self.condensed_starts, np.ndarray):
+            return int((self.condensed_stops - self.condensed_starts).sum())
+        return sum(stop - start for start, stop in zip(self.condensed_starts, self.condensed_stops))
+    
+    def get_answers(self, *, debug=False):
+        answer1 = self.get_answer1(debug=debug)
+        answer2 = self.get_answer2(debug=debug)
+        return answer1, answer2
+
+
 def test():
     lines = test_input.splitlines()
     object = parse(lines, debug=True)
     object.run_analysis(debug=True)
     test1, test2 = object.get_answers(debug=True)
+    batch_object = parse(lines)
+    batch_object.run_analysis(batch=True)
+    assert batch_object.get_answers() == (test1, test2)
+    stream_object, ingredients = parse_stream(iter(lines))
+    assert stream_object.stream_freshness(ingredients, sink=print) == test1
+    stream_object.add_fresh_range(range(30, 33))
+    stream_object.add_fresh_range(range(6, 10))
+    assert stream_object.stream_freshness([1, 5, 8, 11, 17, 32]) == 5
+    assert stream_object.get_answer2() == test2 + 7
+    object.add_fresh_range(range(30, 41))
+    object.run_analysis()
+    assert 32 in object.freshness_index
+    assert object.get_answers() == (test1 + 1, test2 + 11)
+    compact_object = parse_bytes(test_input.encode(), debug=True)
+    compact_object.run_analysis(debug=True)
+    assert compact_object.get_answers() == (test1, test2)
+    large_object = parse_bytes(b"0-4611686018427387903\n5611686018427387904-5611686018427387908\n\n5611686018427387904\n")
+    large_object.run_analysis()
+    assert large_object.get_answers() == (1, 2 ** 62 + 5)
+    assert list(parse_integers(b"12 345\n6 78", chunk_size=2)) == [12, 345, 6, 78]
+    assert list(parse_integers(b"3-5\r\n10-14\r\n", chunk_size=3)) == [3, 5, 10, 14]
+    crlf_object = parse_bytes(test_input.replace("\n", "\r\n").encode())
+    crlf_object.run_analysis()
+    assert crlf_object.get_answers() == (test1, test2)
     print(f"Test 1: {test1}\nTest 2: {test2}")
 
 if __name__ == "__main__":
@@ -1,5 +1,16 @@
+import array
+import heapq
+import itertools
 import math
+import multiprocessing
+import os
 import pathlib 
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 DAY = 8
@@ -43,9 +54,9 @@ def parse(lines, *, debug=False):
 
 class JunctionBox:
     def __init__(self, x, y, z):
-        self.x = float(x)
-        self.y = float(y)
-        self.z = float(z)
+        self.x = int(x)
+        self.y = int(y)
+        self.z = int(z)
         self.connections = set()
     
     def __repr__(self):
@@ -54,11 +65,293 @@ class JunctionBox:
     def connect(self, other):
         self.connections.add(other)
 
+def squared_distance(point1, point2):
+    x1, y1, z1 = point1
+    x2, y2, z2 = point2
+    return (x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2
+
+def heap_edge_stream(points, *, debug=False):
+    heap = [
+        (squared_distance(points[i], points[j]), i, j)
+        for j in range(len(points))
+        for i in range(j)
+    ]
+    heapq.heapify(heap)
+    if debug:
+        print(f"Heapified {len(heap)} candidate pairs")
+    while heap:
+        yield heapq.heappop(heap)
+
+def keep_shortest_edges(dist2, i, j, k):
+    # Keep the k shortest edges plus any ties with the k-th one, so that a
+    # batch always holds every edge up to its largest squared distance
+    if len(dist2) <= k:
+        return dist2, i, j
+    kth = dist2[np.argpartition(dist2, k - 1)[k - 1]]
+    keep = dist2 <= kth
+    return dist2[keep], i[keep], j[keep]
+
+def select_shortest_edges(coords, min_dist2, k, rows_per_tile):
+    n_points = len(coords)
+    no_edge = np.iinfo(np.int64).max
+    dist2_kept = np.empty(0, dtype=np.int64)
+    i_kept = np.empty(0, dtype=np.int64)
+    j_kept = np.empty(0, dtype=np.int64)
+    for start in range(0, n_points - 1, rows_per_tile):
+        stop = min(start + rows_per_tile, n_points - 1)
+        rows = coords[start:stop]
+        cols = coords[start + 1:]
+        dist2 = np.zeros((len(rows), len(cols)), dtype=np.int64)
+        for axis in range(3):
+            dist2 += (rows[:, None, axis] - cols[None, :, axis]) ** 2
+        # Tile entry (a, b) is the pair (start + a, start + 1 + b), valid for a <= b
+        dist2[np.tril_indices(len(rows), -1, len(cols))] = no_edge
+        dist2[dist2 <= min_dist2] = no_edge
+        flat = dist2.ravel()
+        if len(flat) > k:
+            kth = flat[np.argpartition(flat, k - 1)[k - 1]]
+            selected = np.flatnonzero((flat <= kth) & (flat != no_edge))
+        else:
+            selected = np.flatnonzero(flat != no_edge)
+        dist2_kept, i_kept, j_kept = keep_shortest_edges(
+            np.concatenate((dist2_kept, flat[selected])),
+            np.concatenate((i_kept, start + selected // len(cols))),
+            np.concatenate((j_kept, start + 1 + selected % len(cols))),
+            k,
+        )
+    return dist2_kept, i_kept, j_kept
+
+def numpy_edge_stream(points, *, batch_size=None, memory_budget=64 * 2 ** 20, debug=False):
+    # Not a generator itself, so a missing numpy is reported at the call
+    if np is None:
+        raise ImportError("The 'numpy' edge source requires numpy to be installed")
+    return numpy_edge_batches(points, batch_size, memory_budget, debug)
+
+def numpy_edge_batches(points, batch_size, memory_budget, debug):
+    coords = np.array(points, dtype=np.int64).reshape(-1, 3)
+    n_points = len(coords)
+    if n_points < 2:
+        return
+    batch_size = batch_size or 4 * n_points
+    # Roughly six int64-sized arrays of tile shape are alive at the same time
+    rows_per_tile = max(1, memory_budget // (48 * n_points))
+    min_dist2 = -1
+    while True:
+        dist2, i, j = select_shortest_edges(coords, min_dist2, batch_size, rows_per_tile)
+        if len(dist2) == 0:
+            return
+        order = np.lexsort((j, i, dist2))
+        if debug:
+            print(f"Selected {len(dist2)} pairs above squared distance {min_dist2}")
+        yield from zip(dist2[order].tolist(), i[order].tolist(), j[order].tolist())
+        min_dist2 = int(dist2.max())
+
+# Coordinates shared with the worker processes of parallel_edge_stream
+shared_block = None
+shared_coords = None
+
+def attach_shared_coordinates(name, n_points):
+    global shared_block, shared_coords
+    shared_block = shared_memory.SharedMemory(name=name)
+    shared_coords = shared_block.buf[:n_points * 3 * 8].cast("q")
+
+def shortest_edges_in_rows(task):
+    # The k smallest (dist2, i, j) edges with i in [start, stop) that come
+    # after last_edge; tuples are a strict total order, so ties can't split
+    start, stop, last_edge, k = task
+    last_dist2 = last_edge[0]
+    coords = shared_coords
+    n_points = len(coords) // 3
+    def edges():
+        for i in range(start, stop):
+            x1, y1, z1 = coords[3 * i:3 * i + 3]
+            for j in range(i + 1, n_points):
+                x2, y2, z2 = coords[3 * j:3 * j + 3]
+                dist2 = (x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2
+                if dist2 > last_dist2 or (dist2 == last_dist2 and (dist2, i, j) > last_edge):
+                    yield (dist2, i, j)
+    return heapq.nsmallest(k, edges())
+
+def balanced_row_blocks(n_points, n_blocks):
+    # Row i pairs with the n_points - 1 - i rows below it
+    target = n_points * (n_points - 1) / 2 / n_blocks
+    blocks = list()
+    start = 0
+    n_pairs = 0
+    for i in range(n_points - 1):
+        n_pairs += n_points - 1 - i
+        if n_pairs >= target:
+            blocks.append((start, i + 1))
+            start = i + 1
+            n_pairs = 0
+    if start < n_points - 1:
+        blocks.append((start, n_points - 1))
+    return blocks
+
+def parallel_shortest_edges(values, row_blocks, last_edge, batch_size, processes):
+    # The pool and the shared block only live while one batch is collected,
+    # so a stream that is never exhausted does not keep them around
+    n_points = len(values) // 3
+    block = shared_memory.SharedMemory(create=True, size=len(values) * values.itemsize)
+    try:
+        block.buf[:len(values) * values.itemsize] = values.tobytes()
+        with multiprocessing.Pool(
+            processes,
+            initializer=attach_shared_coordinates,
+            initargs=(block.name, n_points)
+        ) as pool:
+            tasks = [(start, stop, last_edge, batch_size) for start, stop in row_blocks]
+            return heapq.nsmallest(
+                batch_size,
+                itertools.chain.from_iterable(pool.map(shortest_edges_in_rows, tasks))
+            )
+    finally:
+        block.close()
+        block.unlink()
+
+def parallel_edge_stream(points, *, processes=None, batch_size=None, debug=False):
+    n_points = len(points)
+    if n_points < 2:
+        return
+    processes = processes or os.cpu_count()
+    batch_size = batch_size or 4 * n_points
+    values = array.array("q", itertools.chain.from_iterable(points))
+    row_blocks = balanced_row_blocks(n_points, 4 * processes)
+    last_edge = (-1, -1, -1)
+    while True:
+        batch = parallel_shortest_edges(values, row_blocks, last_edge, batch_size, processes)
+        if not batch:
+            return
+        if debug:
+            print(f"Merged {len(batch)} pairs from {len(row_blocks)} row blocks")
+        yield from batch
+        last_edge = batch[-1]
+
+# Half of the 26 neighbouring cells, so every pair of cells is visited once
+HALF_STENCIL = [
+    (dx, dy, dz)
+    for dx in (-1, 0, 1)
+    for dy in (-1, 0, 1)
+    for dz in (-1, 0, 1)
+    if (dx, dy, dz) > (0, 0, 0)
+]
+
+class VoxelGrid:
+    def __init__(self, points, cell_size):
+        self.points = points
+        self.cell_size = cell_size
+        self.cells = dict()
+        for index, (x, y, z) in enumerate(points):
+            key = (x // cell_size, y // cell_size, z // cell_size)
+            self.cells.setdefault(key, list()).append(index)
+    
+    def __repr__(self):
+        return f"VoxelGrid(cell_size={self.cell_size}, n_cells={len(self.cells)})"
+    
+    def pairs_within(self, min_dist2, max_dist2):
+        # Only valid for max_dist2 <= cell_size ** 2, so that every pair in
+        # range lies in the same or in adjacent cells.
+        for (cx, cy, cz), members in self.cells.items():
+            for a, i in enumerate(members):
+                for j in members[a + 1:]:
+                    dist2 = squared_distance(self.points[i], self.points[j])
+                    if min_dist2 < dist2 <= max_dist2:
+                        yield (dist2, min(i, j), max(i, j))
+            for dx, dy, dz in HALF_STENCIL:
+                neighbours = self.cells.get((cx + dx, cy + dy, cz + dz))
+                if neighbours is None:
+                    continue
+                for i in members:
+                    for j in neighbours:
+                        dist2 = squared_distance(self.points[i], self.points[j])
+                        if min_dist2 < dist2 <= max_dist2:
+                            yield (dist2, min(i, j), max(i, j))
+
+def initial_search_radius(points):
+    # Cell size at which each cell holds about one point on average
+    volume = 1
+    for axis in zip(*points):
+        volume *= max(max(axis) - min(axis), 1)
+    return max(1, math.ceil((volume / len(points)) ** (1 / 3)))
+
+def grid_edge_stream(points, *, initial_radius=None, debug=False):
+    n_points = len(points)
+    if n_points < 2:
+        return
+    n_pairs = n_points * (n_points - 1) // 2
+    radius = initial_radius or initial_search_radius(points)
+    min_dist2 = -1
+    n_emitted = 0
+    while n_emitted < n_pairs:
+        max_dist2 = radius * radius
+        grid = VoxelGrid(points, radius)
+        batch = sorted(grid.pairs_within(min_dist2, max_dist2))
+        if debug:
+            print(f"Search radius {radius} on {grid!r}: {len(batch)} new pairs")
+        yield from batch
+        n_emitted += len(batch)
+        min_dist2 = max_dist2
+        radius *= 2
+
+class DisjointSet:
+    def __init__(self, n_elements):
+        self.parent = list(range(n_elements))
+        self.size = [1] * n_elements
+        self.n_components = n_elements
+    
+    def __len__(self):
+        return len(self.parent)
+    
+    def __repr__(self):
+        return f"DisjointSet({self.components()!r})"
+    
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression: point every visited element straight at the root
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+    
+    def union(self, i, j):
+        root_i = self.find(i)
+        root_j = self.find(j)
+        if root_i == root_j:
+            return root_i
+        # Union by size: hang the smaller tree below the larger one
+        if self.size[root_i] < self.size[root_j]:
+            root_i, root_j = root_j, root_i
+        self.parent[root_j] = root_i
+        self.size[root_i] += self.size[root_j]
+        self.n_components -= 1
+        return root_i
+    
+    def component_size(self, i):
+        return self.size[self.find(i)]
+    
+    def component_sizes(self):
+        return [self.size[i] for i, parent in enumerate(self.parent) if i == parent]
+    
+    def largest_component_sizes(self, n_largest):
+        return heapq.nlargest(n_largest, self.component_sizes())
+    
+    def all_connected(self):
+        return self.n_components <= 1
+    
+    def components(self):
+        components = dict()
+        for i in range(len(self.parent)):
+            components.setdefault(self.find(i), list()).append(i)
+        return list(components.values())
+
 class Rigging3D:
     def __init__(self, objects):
         self.objects = list(objects)
         self.connections = list()
-        self.circuits = {i: {i} for i in range(len(self.objects))}
+        self.circuits = DisjointSet(len(self.objects))
+        self.edge_stream = iter(())
+        self.last_connection_made = None
     
     def __repr__(self):
         return f"Rigging3D({self.objects!r})"
@@ -73,66 +366,188 @@ class Rigging3D:
             for i in range(j):
                 obj1 = self.objects[i]
                 obj2 = self.objects[j]
-                dist = math.sqrt(
+                dist2 = (
                     (obj1.x - obj2.x) ** 2 +
                     (obj1.y - obj2.y) ** 2 +
                     (obj1.z - obj2.z) ** 2
                 )
-                self.distances[(i, j)] = dist
+                self.distances[(i, j)] = dist2
                 if debug:
-                    print(f"Distance between object {i} and {j}: {dist:.3f}")
+                    print(f"Squared distance between object {i} and {j}: {dist2}")
         return self.distances
     
+    def coordinates(self):
+        return [(obj.x, obj.y, obj.z) for obj in self.objects]
+    
+    def prepare_edges(self, edge_source="full", *, memory_budget=64 * 2 ** 20, processes=None, debug=False):
+        match edge_source:
+            case "full":
+                self.calculate_distances(debug=debug)
+                self.edge_stream = iter(sorted(
+                    (dist2, i, j) for (i, j), dist2 in self.distances.items()
+                ))
+            case "heap":
+                self.edge_stream = heap_edge_stream(self.coordinates(), debug=debug)
+            case "numpy":
+                self.edge_stream = numpy_edge_stream(
+                    self.coordinates(),
+                    memory_budget=memory_budget,
+                    debug=debug
+                )
+            case "parallel":
+                self.edge_stream = parallel_edge_stream(
+                    self.coordinates(),
+                    processes=processes,
+                    debug=debug
+                )
+            case "grid":
+                self.edge_stream = grid_edge_stream(self.coordinates(), debug=debug)
+            case _:
+                raise ValueError(f"Unknown edge source: {edge_source!r}")
+        return self.edge_stream
+    
+    def add_connection(self, dist2, i, j):
+        self.connections.append((dist2, i, j))
+        self.last_connection_made = (i, j)
+        self.objects[i].connect(j)
+        self.objects[j].connect(i)
+        return self.circuits.union(i, j)
+    
     def connect_objects(self, n_connections, *, debug=False):
-        sorted_distances = sorted(
-            self.distances.items(),
-            key=lambda item: item[1]
-        )
+        if self.circuits.all_connected():
+            return
         iteration = 0
         while iteration < n_connections:
             try:
-                (i, j), dist = sorted_distances[iteration]
-            except IndexError:
+                dist2, i, j = next(self.edge_stream)
+            except StopIteration:
                 print(f"No more distances to process after {iteration} connections.")
                 break
-            self.connections.append((i, j))
-            self.objects[i].connect(j)
-            self.objects[j].connect(i)
-            new_circuit = self.circuits[i].union(self.circuits[j])
-            for k in new_circuit:
-                self.circuits[k] = new_circuit
-            if len(new_circuit) == len(self.objects):
+            root = self.add_connection(dist2, i, j)
+            if self.circuits.all_connected():
                 print("All objects are now connected in a single circuit.")
                 break
             if debug:
-                print(f"Connecting object {i} and {j} with distance {dist:.3f}")
-                print(f"  Circuit created: {new_circuit}")
+                print(f"Connecting object {i} and {j} with squared distance {dist2}")
+                print(f"  Circuit now contains {self.circuits.size[root]} objects")
             iteration += 1
         if iteration == n_connections:
             print(f"Reached maximum number of connections: {n_connections}")
-        if debug:
+        if debug and self.last_connection_made is not None:
+            i, j = self.last_connection_made
             print(f"Circuits: {self.circuits}")
             print(f"Last connection made: {(i, j)} (boxes: {self.objects[i]}, {self.objects[j]})")
-        self.last_connection_made = (i, j)
 
-    def run_analysis(self, *, n_connections_initial=1000, n_connections_max=1_000_000, debug=False):
+    def run_analysis(self, *, n_connections_initial=1000, n_connections_max=1_000_000, edge_source="full", memory_budget=64 * 2 ** 20, processes=None, debug=False):
         if debug:
             print(f"Running analysis on {self!r}...")
-        self.calculate_distances(debug=debug)
+        self.prepare_edges(edge_source, memory_budget=memory_budget, processes=processes, debug=debug)
         self.connect_objects(n_connections_initial, debug=debug)
+        self.n_connections_initial = n_connections_initial
+        self.n_connections_max = n_connections_max
+        self.initial_connections = list(self.connections)
+        # Connecting stops once everything is connected, but add_box still
+        # needs the first n_connections_initial edges of the stream
+        n_missing = n_connections_initial - len(self.initial_connections)
+        if n_missing > 0:
+            missing_edges = list(itertools.islice(self.edge_stream, n_missing))
+            self.initial_connections.extend(missing_edges)
+            self.edge_stream = itertools.chain(missing_edges, self.edge_stream)
         self.answer1 = self.calculate_answer1(debug=debug)
         self.connect_objects(n_connections_max - n_connections_initial, debug=debug)
     
-    def calculate_answer1(self, *, n_largest=3, debug=False):
-        unique_circuits = set(frozenset(circuit) for circuit in self.circuits.values())
-        unique_circuits = sorted(
-            unique_circuits,
-            key=lambda circuit: len(circuit),
-            reverse=True
+    def snapshot(self, *, n_largest=3):
+        return {
+            "n_connections": len(self.connections),
+            "n_circuits": self.circuits.n_components,
+            "largest_circuits": self.circuits.largest_component_sizes(n_largest),
+            "last_connection": self.last_connection_made,
+        }
+    
+    def checkpoint_reached(self, checkpoint, next_edge):
+        kind, value = checkpoint
+        match kind:
+            case "connections":
+                return len(self.connections) >= value
+            case "distance":
+                return next_edge is None or next_edge[0] > value ** 2
+            case "circuits":
+                return self.circuits.n_components <= value
+            case _:
+                raise ValueError(f"Unknown checkpoint kind: {kind!r}")
+    
+    def connect_until_checkpoints(self, checkpoints, *, n_largest=3, debug=False):
+        snapshots = [None] * len(checkpoints)
+        pending = list(range(len(checkpoints)))
+        next_edge = next(self.edge_stream, None)
+        while pending:
+            still_pending = list()
+            for index in pending:
+                if self.checkpoint_reached(checkpoints[index], next_edge):
+                    snapshots[index] = self.snapshot(n_largest=n_largest)
+                    if debug:
+                        print(f"Checkpoint {checkpoints[index]}: {snapshots[index]}")
+                else:
+                    still_pending.append(index)
+            pending = still_pending
+            if not pending or next_edge is None:
+                break
+            self.add_connection(*next_edge)
+            next_edge = next(self.edge_stream, None)
+        # Checkpoints that can never be reached get the final state
+        for index in pending:
+            snapshots[index] = self.snapshot(n_largest=n_largest)
+        if next_edge is not None:
+            self.edge_stream = itertools.chain([next_edge], self.edge_stream)
+        return snapshots
+    
+    def run_checkpoints(self, checkpoints, *, n_largest=3, edge_source="full", memory_budget=64 * 2 ** 20, processes=None, debug=False):
+        self.prepare_edges(edge_source, memory_budget=memory_budget, processes=processes, debug=debug)
+        return self.connect_until_checkpoints(checkpoints, n_largest=n_largest, debug=debug)
+    
+    def add_box(self, box, *, debug=False):
+        # Only valid after run_analysis: the answers are updated from the
+        # edges made so far and the new box's edges instead of all pairs
+        index = len(self.objects)
+        new_point = (box.x, box.y, box.z)
+        new_edges = sorted(
+            (squared_distance(point, new_point), i, index)
+            for i, point in enumerate(self.coordinates())
         )
+        self.objects.append(box)
+        if debug:
+            print(f"Adding {box!r} as object {index}")
+        
+        # The first connections of the grown rigging come from the old ones and the new box
+        self.initial_connections = list(itertools.islice(
+            heapq.merge(self.initial_connections, new_edges),
+            self.n_connections_initial
+        ))
+        initial_circuits = DisjointSet(len(self.objects))
+        for dist2, i, j in self.initial_connections:
+            initial_circuits.union(i, j)
+        self.answer1 = self.calculate_answer1(circuits=initial_circuits, debug=debug)
+        
+        # The edges made so far followed by the pending stream are the old edge
+        # order, so replaying them with the new edges under the same connection
+        # budget gives the grown rigging, whether or not it was fully connected
+        self.edge_stream = heapq.merge(self.connections, new_edges, self.edge_stream)
+        for obj in self.objects:
+            obj.connections = set()
+        self.connections = list()
+        self.circuits = DisjointSet(len(self.objects))
+        self.last_connection_made = None
+        self.connect_objects(self.n_connections_max, debug=debug)
+        if debug:
+            print(f"Last connection made: {self.last_connection_made}")
+    
+    def calculate_answer1(self, *, circuits=None, n_largest=3, debug=False):
+        circuits = circuits or self.circuits
+        largest_sizes = circuits.largest_component_sizes(n_largest)
         if debug:
-            print(f"Unique circuits: {unique_circuits}")
-        return math.prod(len(circuit) for circuit in unique_circuits[:n_largest])
+            print(f"Number of circuits: {circuits.n_components}")
+            print(f"Largest circuit sizes: {largest_sizes}")
+        return math.prod(largest_sizes)
 
     def get_answer1(self, *, debug=False):
         return self.answer1
@@ -140,7 +555,7 @@ class Rigging3D:
     def get_answer2(self, *, debug=False):
         box1 = self.objects[self.last_connection_made[0]]
         box2 = self.objects[self.last_connection_made[1]]
-        return int(box1.x) * int(box2.x)
+        return box1.x * box2.x
     
     def get_answers(self, *, debug=False):
         answer1 = self.get_answer1(debug=debug)
@@ -153,6 +568,45 @@ def test():
     object = parse(lines, debug=True)
     object.run_analysis(n_connections_initial=10, n_connections_max=1000, debug=True)
     test1, test2 = object.get_answers(debug=True)
+    edge_sources = ["grid", "heap", "parallel"] + (["numpy"] if np is not None else [])
+    for edge_source in edge_sources:
+        other = parse(lines)
+        other.run_analysis(n_connections_initial=10, n_connections_max=1000, edge_source=edge_source)
+        assert other.get_answers() == (test1, test2)
+    if np is None:
+        try:
+            parse(lines).prepare_edges("numpy")
+        except ImportError:
+            pass
+        else:
+            raise AssertionError("Expected ImportError without numpy")
+    online_object = parse(lines[:15])
+    online_object.run_analysis(n_connections_initial=10, n_connections_max=1000)
+    for box in parse(lines[15:]).objects:
+        online_object.add_box(box, debug=True)
+    assert online_object.get_answers() == (test1, test2)
+    small_lines = ["0,0,0", "1,0,0", "0,1,0", "1,1,0", "0,0,1", "500,500,500"]
+    small_object = parse(small_lines[:5])
+    small_object.run_analysis(n_connections_initial=10, n_connections_max=1000)
+    small_object.add_box(JunctionBox(500, 500, 500))
+    full_object = parse(small_lines)
+    full_object.run_analysis(n_connections_initial=10, n_connections_max=1000)
+    assert small_object.get_answers() == full_object.get_answers() == (5, 500)
+    capped_object = parse(lines[:19])
+    capped_object.run_analysis(n_connections_initial=10, n_connections_max=20)
+    capped_object.add_box(parse(lines[19:]).objects[0])
+    full_capped_object = parse(lines)
+    full_capped_object.run_analysis(n_connections_initial=10, n_connections_max=20)
+    assert capped_object.get_answers() == full_capped_object.get_answers() == (40, 792120)
+    assert capped_object.circuits.n_components == full_capped_object.circuits.n_components
+    assert list(capped_object.edge_stream) == list(full_capped_object.edge_stream)
+    checkpoints = [("connections", 10), ("distance", 350), ("circuits", 1)]
+    checkpoint_object = parse(lines)
+    snapshots = checkpoint_object.run_checkpoints(checkpoints, debug=True)
+    assert math.prod(snapshots[0]["largest_circuits"]) == test1
+    assert snapshots[1]["n_connections"] == 8
+    i, j = snapshots[2]["last_connection"]
+    assert checkpoint_object.objects[i].x * checkpoint_object.objects[j].x == test2
     print(f"Test 1: {test1}\nTest 2: {test2}")
 
 if __name__ == "__main__":